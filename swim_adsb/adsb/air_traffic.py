@@ -27,22 +27,375 @@ http://opensource.org/licenses/BSD-3-Clause
 
 Details on EUROCONTROL: http://www.eurocontrol.int
 """
-import json
 import logging
 import os
-from datetime import datetime, timedelta
-from typing import Tuple, List, Callable, Dict, Optional, Any
-
-from cachetools import cached, TTLCache
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, datetime, time, timedelta
+from functools import partial, lru_cache
+from time import monotonic
+from typing import Tuple, List, Callable, Dict, Optional, Any, Hashable, MutableMapping, TypeVar, NamedTuple
+from weakref import WeakValueDictionary
+
+import requests
+from cachetools import TTLCache
+from cachetools.keys import hashkey
 from proton import Message
 
 # Official OpenSky client (provided alongside this module)
 from swim_adsb.adsb.opensky_api import OpenSkyApi, StateVector, FlightData
 
+try:
+    from orjson import dumps as _json_dumps
+except ImportError:
+    from json import dumps as _str_json_dumps
+
+    def _json_dumps(obj: Any) -> bytes:
+        return _str_json_dumps(obj, separators=(',', ':')).encode('utf-8')
+
 _logger = logging.getLogger(__name__)
 
 AirTrafficDataType = Dict[str, Any]
 
+T = TypeVar('T')
+
+
+class StatesSnapshot(NamedTuple):
+    """
+    A states dict shared through the handlers' context, valid until `expires_at` (see `time.monotonic`).
+    """
+    states_dict: Dict[str, StateVector]
+    expires_at: float
+
+
+class _EnvCredentials(NamedTuple):
+    """
+    OpenSky credentials provided via the environment.
+    """
+    client_id: Optional[str]
+    client_secret: Optional[str]
+    token_url: Optional[str]
+    scope: Optional[str]
+    username: Optional[str]
+    password: Optional[str]
+
+
+# The environment is read once, at import time
+_ENV_CREDENTIALS = _EnvCredentials(
+    client_id=os.getenv("OPENSKY_CLIENT_ID"),
+    client_secret=os.getenv("OPENSKY_CLIENT_SECRET"),
+    token_url=os.getenv("OPENSKY_TOKEN_URL"),
+    scope=os.getenv("OPENSKY_SCOPE"),
+    username=os.getenv("OPENSKY_USERNAME"),
+    password=os.getenv("OPENSKY_PASSWORD"),
+)
+
+
+# OpenSkyApi builds a pooled session with its retry policy for every instance; sharing one across the AirTraffic
+# instances lets them also share the keep-alive connections
+_SHARED_SESSION = OpenSkyApi._build_session()
+
+
+def _ttl_from_env(name: str, default: int) -> int:
+    """
+    Returns the positive number of seconds of the environment variable `name` or `default` if it is missing or
+    malformed.
+    """
+    value = os.getenv(name)
+    if value is None:
+        return default
+
+    try:
+        ttl = int(value)
+    except ValueError:
+        ttl = 0
+
+    if ttl <= 0:
+        _logger.warning("Invalid %s value %r, falling back to %s seconds.", name, value, default)
+        return default
+
+    return ttl
+
+
+# Arrivals/departures cover whole days and change slowly whereas states change every few seconds, hence the
+# different expiry times (in seconds). Both can be overridden via the environment.
+_FLIGHTS_TTL = _ttl_from_env("OPENSKY_FLIGHTS_TTL", default=1800)
+_STATES_TTL = _ttl_from_env("OPENSKY_STATES_TTL", default=15)
+
+
+class _CacheEntry(NamedTuple):
+    """
+    A cached value along with its expiry time (see `time.monotonic`), whether it is being refreshed and, after a
+    failed refresh, the earliest time of the next attempt.
+    """
+    value: Any
+    expires_at: float
+    refreshing: bool = False
+    retry_at: float = 0.0
+
+
+class _OpenSkyUnavailableError(Exception):
+    """
+    Raised when OpenSky could not provide the requested data, e.g. due to rate limiting or connectivity issues.
+    """
+
+
+# {key: _CacheEntry}. Expired entries are kept around for another TTL in order to be served while they are being
+# refreshed and are evicted afterwards.
+_FLIGHTS_CACHE: Dict[Hashable, _CacheEntry] = {}
+_STATES_CACHE: Dict[Hashable, _CacheEntry] = {}
+
+_RESPONSE_CACHE = TTLCache(maxsize=2048, ttl=_STATES_TTL)
+
+# Per key locks of the computations in flight. Entries vanish once no caller holds the lock anymore.
+_FLIGHTS_LOCKS: MutableMapping[Hashable, threading.Lock] = WeakValueDictionary()
+_STATES_LOCKS: MutableMapping[Hashable, threading.Lock] = WeakValueDictionary()
+
+# Serializes the accesses to the caches and the lock maps, except for the lock-free fresh hits of
+# _stale_while_revalidate
+_CACHE_LOCK = threading.RLock()
+
+# Run the refreshes of the expired cache entries, one pool per cache so that the slow flight connections refreshes
+# cannot hold back the states refresh
+_FLIGHTS_REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix='opensky-flights-refresh')
+_STATES_REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='opensky-states-refresh')
+
+# Fans out the arrivals/departures requests of several airports
+_PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='opensky-prefetch')
+
+# Upper bound of the delay (in seconds) before retrying a failed refresh
+_FAILED_REFRESH_RETRY_DELAY = 60
+
+
+class _CachedResponse(NamedTuple):
+    """
+    A JSON payload along with the states and flight connections it was built from.
+    """
+    states_dict: Dict[str, StateVector]
+    flight_connections_dict: Dict[str, FlightData]
+    payload: bytes
+
+
+def _cache_get(cache: TTLCache, key: Hashable) -> Tuple[bool, Any]:
+    """
+    Returns whether `key` is in the cache along with its value, if any.
+    """
+    with _CACHE_LOCK:
+        try:
+            return True, cache[key]
+        except KeyError:
+            return False, None
+
+
+def _singleflight(lock_map: MutableMapping[Hashable, threading.Lock],
+                  key: Hashable,
+                  lookup: Callable[[], Tuple[bool, T]],
+                  fn: Callable[[], T]) -> T:
+    """
+    Returns the value found by `lookup` or computes it via `fn`, making sure that concurrent callers asking for the
+    same missing key trigger only one computation; the rest wait for it and reuse its result.
+
+    :param lock_map: the map holding the locks of the computations in flight
+    :param key: the cache key
+    :param lookup: returns whether the value was found and the value itself
+    :param fn: computes (and caches) the value when `lookup` does not find it
+    """
+    hit, value = lookup()
+    if hit:
+        return value
+
+    with _CACHE_LOCK:
+        lock = lock_map.setdefault(key, threading.Lock())
+
+    with lock:
+        # another caller may have computed it while we were waiting
+        hit, value = lookup()
+        if hit:
+            return value
+
+        return fn()
+
+
+def _evict_outdated(cache: Dict[Hashable, _CacheEntry], ttl: float, now: float) -> None:
+    """
+    Removes the entries that expired more than `ttl` seconds ago, i.e. that can no longer be served. Must be called
+    while holding _CACHE_LOCK.
+    """
+    outdated_keys = [key for key, entry in cache.items() if not entry.refreshing and now >= entry.expires_at + ttl]
+
+    for key in outdated_keys:
+        del cache[key]
+
+
+def _refresh(cache: Dict[Hashable, _CacheEntry], key: Hashable, fn: Callable[[], T], ttl: float, fallback: T) -> T:
+    """
+    Computes the value of `key` via `fn` and caches it for `ttl` seconds.
+
+    If the computation fails the previous value keeps being served, as long as it has not expired for more than `ttl`
+    seconds, otherwise `fallback` is served. In both cases the computation is retried after a short delay.
+    """
+    try:
+        value = fn()
+    except Exception as e:
+        if not isinstance(e, _OpenSkyUnavailableError):
+            _log_api_error(str(key), e, "Failed to refresh %s: %s", key, e)
+
+        now = monotonic()
+        retry_delay = min(ttl, _FAILED_REFRESH_RETRY_DELAY)
+
+        with _CACHE_LOCK:
+            entry = cache.get(key)
+
+            if entry is not None and now < entry.expires_at + ttl:
+                cache[key] = entry._replace(refreshing=False, retry_at=now + retry_delay)
+                return entry.value
+
+            cache[key] = _CacheEntry(fallback, expires_at=now + retry_delay)
+
+        return fallback
+
+    now = monotonic()
+
+    with _CACHE_LOCK:
+        cache[key] = _CacheEntry(value, expires_at=now + ttl)
+        _evict_outdated(cache, ttl, now)
+
+    return value
+
+
+def _stale_while_revalidate(cache: Dict[Hashable, _CacheEntry],
+                            lock_map: MutableMapping[Hashable, threading.Lock],
+                            executor: ThreadPoolExecutor,
+                            key: Hashable,
+                            fn: Callable[[], T],
+                            ttl: float,
+                            fallback: T) -> T:
+    """
+    Returns the cached value of `key`, computing it via `fn` if missing.
+
+    A value expired less than `ttl` seconds ago is still returned right away while it is refreshed in the background,
+    so that expiry does not block the callers. Older values are recomputed in the foreground.
+
+    :param cache: the cache holding the computed values
+    :param lock_map: the map holding the locks of the computations in flight
+    :param executor: runs the background refreshes
+    :param key: the cache key
+    :param fn: computes the value, raises if OpenSky is unavailable
+    :param ttl: time to live of the computed values in seconds
+    :param fallback: the value to serve if `fn` fails and there is no previous value to fall back to
+    """
+    # Fresh hits need no locking: entries are immutable and dict.get is atomic, only writes go through _CACHE_LOCK
+    entry = cache.get(key)
+    if entry is not None and monotonic() < entry.expires_at:
+        return entry.value
+
+    refresh = partial(_refresh, cache, key, fn, ttl, fallback)
+
+    def lookup() -> Tuple[bool, Any]:
+        now = monotonic()
+
+        with _CACHE_LOCK:
+            entry = cache.get(key)
+
+            if entry is None or now >= entry.expires_at + ttl:
+                return False, None
+
+            if now >= entry.expires_at and not entry.refreshing and now >= entry.retry_at:
+                cache[key] = entry._replace(refreshing=True)
+                executor.submit(refresh)
+
+            return True, entry.value
+
+    return _singleflight(lock_map, key, lookup=lookup, fn=refresh)
+
+
+# HTTP statuses OpenSky returns while rate limiting or briefly unavailable
+_TRANSIENT_HTTP_STATUSES = (429, 503)
+
+# Identical API errors are logged at most once within this window (in seconds)
+_API_ERROR_LOG_WINDOW = 60
+
+# {(source, error type name): last time logged (see `time.monotonic`)}
+_API_ERRORS_LOGGED_AT: Dict[Tuple[str, str], float] = {}
+_API_ERRORS_LOCK = threading.Lock()
+
+
+def _is_transient_api_error(error: Exception) -> bool:
+    """
+    Returns whether the error is expected to go away by itself, e.g. rate limiting or connectivity issues.
+    """
+    if isinstance(error, (requests.exceptions.ConnectionError,
+                          requests.exceptions.Timeout,
+                          requests.exceptions.RetryError,
+                          # raised for the empty responses, i.e. the requests OpenSky kept rate limiting past the retries
+                          _OpenSkyUnavailableError)):
+        return True
+
+    response = getattr(error, 'response', None)
+
+    return response is not None and response.status_code in _TRANSIENT_HTTP_STATUSES
+
+
+def _log_api_error(source: str, error: Exception, msg: str, *args: Any) -> None:
+    """
+    Logs an OpenSky API error as a warning if it is transient or as an error otherwise. Repetitions of the same error
+    type for the same source within `_API_ERROR_LOG_WINDOW` seconds are dropped.
+
+    :param source: what was being retrieved, e.g. the airport ICAO
+    :param error: the error raised by the API call
+    :param msg: the log message
+    :param args: the log message arguments
+    """
+    key = (source, type(error).__name__)
+    now = monotonic()
+
+    with _API_ERRORS_LOCK:
+        logged_at = _API_ERRORS_LOGGED_AT.get(key)
+        if logged_at is not None and now - logged_at < _API_ERROR_LOG_WINDOW:
+            return
+        _API_ERRORS_LOGGED_AT[key] = now
+
+    level = logging.WARNING if _is_transient_api_error(error) else logging.ERROR
+    _logger.log(level, msg, *args)
+
+
+# Fallback for the airports OpenSky could not identify
+_UNKNOWN_AIRPORT = "Unknown airport"
+
+
+def _get_flight_data(state: StateVector, flight_connection: FlightData) -> AirTrafficDataType:
+    """
+    Combines data of an ongoing flight (live state) with an arrival or departure record and returns a subset.
+    """
+    return {
+        'icao24': state.icao24,
+        'lat': state.latitude,
+        'lng': state.longitude,
+        'from': flight_connection.estDepartureAirport or _UNKNOWN_AIRPORT,
+        'to': flight_connection.estArrivalAirport or _UNKNOWN_AIRPORT,
+        'last_contact': state.last_contact
+    }
+
+
+@lru_cache(maxsize=4)
+def _day_span(ordinal: int, span_in_days: int) -> Tuple[int, int]:
+    """
+    Returns the timestamp of the start (00:00:00) of the day `span_in_days` before the one of the given ordinal and
+    the timestamp of the end (23:59:59) of the latter.
+
+    Timestamps are in seconds since UNIX epoch. The value only changes at midnight, hence the memoization.
+
+    :param ordinal: proleptic Gregorian ordinal of the last day (see `date.toordinal`)
+    :param span_in_days: number of days to look back
+    """
+    last_day = date.fromordinal(ordinal)
+    first_day = last_day - timedelta(days=span_in_days)
+
+    start_of_first_day = datetime.combine(first_day, time.min)
+    end_of_last_day = datetime.combine(last_day, time.max)
+
+    return int(start_of_first_day.timestamp()), int(end_of_last_day.timestamp())
+
 
 class AirTraffic:
     def __init__(
@@ -73,6 +426,10 @@ class AirTraffic:
              - OAuth2:  OPENSKY_CLIENT_ID, OPENSKY_CLIENT_SECRET, OPENSKY_TOKEN_URL (optional), OPENSKY_SCOPE (optional)
              - Basic:   OPENSKY_USERNAME, OPENSKY_PASSWORD
 
+        Caching (environment variables, read at import time, in seconds):
+          - OPENSKY_FLIGHTS_TTL: how long arrivals/departures are cached (default 1800)
+          - OPENSKY_STATES_TTL: how long the flight states are cached (default 15)
+
         :param traffic_time_span_in_days: Number of days to look back when querying arrivals/departures.
         :param username: Optional OpenSky username (legacy; not used if OAuth2 creds are provided).
         :param password: Optional OpenSky password.
@@ -80,19 +437,22 @@ class AirTraffic:
         :param client_secret: OAuth2 Client Secret.
         :param token_url: OAuth2 token endpoint (defaults to OpenSky official endpoint if not provided).
         :param scope: Optional OAuth2 scope.
-        :param session: Optional requests.Session to reuse connections.
+        :param session: Optional requests.Session to reuse connections. Defaults to a module-wide pooled session.
         :param use_env_credentials: If True, pull missing creds from environment variables.
         """
         self.traffic_time_span_in_days = traffic_time_span_in_days
 
         if use_env_credentials:
             # Only fill from env if not explicitly passed
-            client_id = client_id or os.getenv("OPENSKY_CLIENT_ID")
-            client_secret = client_secret or os.getenv("OPENSKY_CLIENT_SECRET")
-            token_url = token_url or os.getenv("OPENSKY_TOKEN_URL")
-            scope = scope or os.getenv("OPENSKY_SCOPE")
-            username = username or os.getenv("OPENSKY_USERNAME")
-            password = password or os.getenv("OPENSKY_PASSWORD")
+            client_id = client_id or _ENV_CREDENTIALS.client_id
+            client_secret = client_secret or _ENV_CREDENTIALS.client_secret
+            token_url = token_url or _ENV_CREDENTIALS.token_url
+            scope = scope or _ENV_CREDENTIALS.scope
+            username = username or _ENV_CREDENTIALS.username
+            password = password or _ENV_CREDENTIALS.password
+
+        if session is None:
+            session = _SHARED_SESSION
 
         # Prefer OAuth2 if available
         if client_id and client_secret:
@@ -112,162 +472,217 @@ class AirTraffic:
             else:
                 _logger.info("AirTraffic: using anonymous access (rate-limited).")
 
-    @property
-    def _days_span_in_timestamps(self) -> Tuple[int, int]:
-        """
-        Returns the timestamp of the start (00:00:00) of the day `traffic_time_span_in_days`
-        before the current one and the timestamp of the end (23:59:59) of the current day.
-
-        Timestamps are in seconds since UNIX epoch.
+    def _flight_connections_today(self, icao: str, callback: Callable[[str, int, int], Optional[List[FlightData]]]) -> Dict[str, FlightData]:
         """
-        last_day = datetime.today()
-        first_day = last_day - timedelta(days=self.traffic_time_span_in_days)
+        Returns the flight connections (arrivals or departures based on the callback) within the current time span
+        mapped by icao24.
 
-        start_of_first_day = first_day.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_last_day = last_day.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-        return int(start_of_first_day.timestamp()), int(end_of_last_day.timestamp())
-
-    def _flight_connections_today(self, icao: str, callback: Callable[[str, int, int], Optional[List[FlightData]]]) -> List[FlightData]:
-        """
-        Returns the flight connections (arrivals or departures based on the callback) within the current time span.
+        The same aircraft may appear more than once within the time span, in which case the last connection returned
+        by OpenSky is kept.
 
         :param icao: airport identifier (ICAO code)
         :param callback: function to call (self.client.get_arrivals_by_airport or get_departures_by_airport)
+        :raises _OpenSkyUnavailableError: if the flight connections could not be retrieved
         """
-        begin, end = self._days_span_in_timestamps
+        begin, end = _day_span(date.today().toordinal(), self.traffic_time_span_in_days)
 
         try:
-            result = callback(icao, begin, end) or []
+            flight_connections = callback(icao, begin, end)
         except Exception as e:
-            _logger.error("OpenSky API error for %s between %s and %s: %s", icao, begin, end, e)
-            result = []
+            _log_api_error(icao, e, "OpenSky API error for %s between %s and %s: %s", icao, begin, end, e)
+            raise _OpenSkyUnavailableError(f"Failed to retrieve the flight connections of {icao}") from e
 
-        return result
+        if flight_connections is None:
+            # the OpenSky client returns None on any failed request, airports without flights come back empty
+            error = _OpenSkyUnavailableError(f"No flight connections returned for {icao}")
+            _log_api_error(icao, error, "OpenSky API returned no flight connections for %s between %s and %s",
+                           icao, begin, end)
+            raise error
 
-    @cached(cache=TTLCache(maxsize=1024, ttl=600))
-    def _arrivals_today_handler(self, icao: str) -> List[FlightData]:
+        # icao24 is expected in lowercase
+        return {fc.icao24: fc for fc in flight_connections if fc.icao24}
+
+    def _arrivals_today_handler(self, icao: str) -> Dict[str, FlightData]:
+        """
+        Returns the flight arrivals of the current day span mapped by icao24.
+
+        Result is cached for OPENSKY_FLIGHTS_TTL seconds (30 minutes by default).
+        """
+        return _stale_while_revalidate(
+            _FLIGHTS_CACHE,
+            _FLIGHTS_LOCKS,
+            _FLIGHTS_REFRESH_EXECUTOR,
+            key=hashkey('arrivals', self, icao),
+            fn=partial(self._flight_connections_today, icao, callback=self.client.get_arrivals_by_airport),
+            ttl=_FLIGHTS_TTL,
+            fallback={}
+        )
+
+    def _departures_today_handler(self, icao: str) -> Dict[str, FlightData]:
         """
-        Returns the flight arrivals of the current day span.
+        Returns the flight departures of the current day span mapped by icao24.
 
-        Result is cached for 10 minutes.
+        Result is cached for OPENSKY_FLIGHTS_TTL seconds (30 minutes by default).
         """
-        return self._flight_connections_today(icao, callback=self.client.get_arrivals_by_airport)
+        return _stale_while_revalidate(
+            _FLIGHTS_CACHE,
+            _FLIGHTS_LOCKS,
+            _FLIGHTS_REFRESH_EXECUTOR,
+            key=hashkey('departures', self, icao),
+            fn=partial(self._flight_connections_today, icao, callback=self.client.get_departures_by_airport),
+            ttl=_FLIGHTS_TTL,
+            fallback={}
+        )
 
-    @cached(cache=TTLCache(maxsize=1024, ttl=600))
-    def _departures_today_handler(self, icao: str) -> List[FlightData]:
+    def prefetch_airports(self, icaos: List[str]) -> None:
         """
-        Returns the flight departures of the current day span.
+        Retrieves concurrently the arrivals and departures of the given airports so that the subsequent calls of
+        their handlers find them already cached.
 
-        Result is cached for 10 minutes.
+        :param icaos: airport identifiers (ICAO codes)
         """
-        return self._flight_connections_today(icao, callback=self.client.get_departures_by_airport)
+        futures = [_PREFETCH_EXECUTOR.submit(handler, icao)
+                   for icao in icaos
+                   for handler in (self._arrivals_today_handler, self._departures_today_handler)]
+
+        wait(futures)
 
     def _get_states(self) -> List[StateVector]:
         """
         Returns the current list of flight states.
+
+        :raises _OpenSkyUnavailableError: if the states could not be retrieved
         """
         try:
             states_obj = self.client.get_states()  # returns OpenSkyStates or None
-            if states_obj is None:
-                return []
-            result = states_obj.states or []
         except Exception as e:
-            _logger.error("OpenSky API get_states error: %s", e)
-            result = []
+            _log_api_error('states', e, "OpenSky API get_states error: %s", e)
+            raise _OpenSkyUnavailableError("Failed to retrieve the states") from e
+
+        if states_obj is None:
+            # the OpenSky client returns None on any non 200 response or when rate limited client side
+            error = _OpenSkyUnavailableError("No states returned")
+            _log_api_error('states', error, "OpenSky API returned no states")
+            raise error
 
-        return result
+        return states_obj.states or []
 
-    @cached(cache=TTLCache(maxsize=1024, ttl=30))
     def get_states_dict(self, context: Optional[Any] = None) -> Dict[str, StateVector]:
         """
         Builds a dictionary {icao24: StateVector} for quick lookup.
+
+        Result is cached for OPENSKY_STATES_TTL seconds (15 seconds by default). If a context is provided the result
+        is also stashed on it (as `context.states_snapshot`) so that the handlers sharing it reuse the same snapshot.
+
+        :param context: optional context shared among the handlers of the same tick
+        """
+        snapshot: Optional[StatesSnapshot] = getattr(context, 'states_snapshot', None)
+        if snapshot is not None and monotonic() < snapshot.expires_at:
+            return snapshot.states_dict
+
+        key = hashkey('states', self)
+        states_dict = _stale_while_revalidate(
+            _STATES_CACHE,
+            _STATES_LOCKS,
+            _STATES_REFRESH_EXECUTOR,
+            key=key,
+            fn=self._build_states_dict,
+            ttl=_STATES_TTL,
+            fallback={}
+        )
+
+        if context is not None:
+            # the snapshot expires along with the cache entry it comes from, so a stale entry being refreshed is not
+            # reused from the context
+            entry = _STATES_CACHE.get(key)
+            expires_at = entry.expires_at if entry is not None and entry.value is states_dict else 0.0
+
+            try:
+                context.states_snapshot = StatesSnapshot(states_dict, expires_at=expires_at)
+            except AttributeError:
+                # the context does not accept new attributes, the snapshot is just not shared
+                pass
+
+        return states_dict
+
+    def _build_states_dict(self) -> Dict[str, StateVector]:
+        """
+        Retrieves the current states and maps them by icao24.
         """
         states = self._get_states()
-        return {state.icao24: state for state in states if getattr(state, "icao24", None)}
+        return {icao24: state for state in states if (icao24 := state.icao24)}
 
     def arrivals_handler(self, airport: str, context: Optional[Any] = None) -> Message:
         """
         Callback for arrival-related topics. Returns a Proton Message containing JSON data.
         """
-        states_dict = self.get_states_dict()
-
-        data = self._flight_connection_handler(
+        body = self._flight_connection_payload(
             airport,
-            states_dict=states_dict,
+            direction='arrivals',
+            states_dict=self.get_states_dict(context),
             get_flight_connections_handler=self._arrivals_today_handler
         )
 
-        return Message(body=json.dumps(data), content_type='application/json')
+        return Message(body=body, content_type='application/json')
 
     def departures_handler(self, airport: str, context: Optional[Any] = None) -> Message:
         """
         Callback for departure-related topics. Returns a Proton Message containing JSON data.
         """
-        states_dict = self.get_states_dict()
-
-        data = self._flight_connection_handler(
+        body = self._flight_connection_payload(
             airport,
-            states_dict=states_dict,
+            direction='departures',
+            states_dict=self.get_states_dict(context),
             get_flight_connections_handler=self._departures_today_handler
         )
 
-        return Message(body=json.dumps(data), content_type='application/json')
+        return Message(body=body, content_type='application/json')
 
-    def _flight_connection_handler(
+    def _flight_connection_payload(
             self,
             airport: str,
+            direction: str,
             states_dict: Dict[str, StateVector],
-            get_flight_connections_handler: Callable[[str], List[FlightData]]) -> List[AirTrafficDataType]:
+            get_flight_connections_handler: Callable[[str], Dict[str, FlightData]]) -> bytes:
         """
-        Matches the flight connections (arrivals or departures for the given airport) with the current states
-        and returns a subset of the data of those ongoing flights.
+        Returns the JSON encoded data of the ongoing flights of the airport.
+
+        The payload is cached and reused as long as both the states and the flight connections it was built from are
+        still the ones served by their caches.
         :param airport: ICAO of the airport
+        :param direction: 'arrivals' or 'departures'
         :param states_dict: mapping of icao24 -> current StateVector
         :param get_flight_connections_handler: function to retrieve connections for the airport
         """
-        flight_connections = get_flight_connections_handler(airport) or []
+        flight_connections_dict = get_flight_connections_handler(airport)
+        key = hashkey(self, airport, direction)
 
-        # Map by icao24 (lowercase expected)
-        flight_connections_dict: Dict[str, FlightData] = {
-            getattr(fc, "icao24", None): fc for fc in flight_connections if getattr(fc, "icao24", None)
-        }
+        hit, response = _cache_get(_RESPONSE_CACHE, key)
+        if hit and response.states_dict is states_dict and response.flight_connections_dict is flight_connections_dict:
+            return response.payload
 
-        # Keep only connections with a currently tracked state
-        flight_connections_with_state = {
-            icao24: fc for icao24, fc in flight_connections_dict.items() if icao24 in states_dict
-        }
+        data = self._flight_connection_handler(states_dict, flight_connections_dict)
+        payload = _json_dumps(data)
 
-        data = [self._get_flight_data(states_dict.get(fc_icao24), fc)
-                for fc_icao24, fc in flight_connections_with_state.items()]
+        with _CACHE_LOCK:
+            _RESPONSE_CACHE[key] = _CachedResponse(states_dict, flight_connections_dict, payload)
 
-        return data
+        return payload
 
-    @staticmethod
-    def _get_flight_data(state: Optional[StateVector], flight_connection: FlightData) -> AirTrafficDataType:
+    def _flight_connection_handler(
+            self,
+            states_dict: Dict[str, StateVector],
+            flight_connections_dict: Dict[str, FlightData]) -> List[AirTrafficDataType]:
         """
-        Combines data of an ongoing flight (live state) with an arrival or departure record and returns a subset.
+        Matches the flight connections (arrivals or departures of an airport) with the current states
+        and returns a subset of the data of those ongoing flights.
+        :param states_dict: mapping of icao24 -> current StateVector
+        :param flight_connections_dict: mapping of icao24 -> FlightData of the airport
         """
-        # Fallbacks for unknown airports
-        from_airport = getattr(flight_connection, "estDepartureAirport", None) or "Unknown airport"
-        to_airport = getattr(flight_connection, "estArrivalAirport", None) or "Unknown airport"
-
-        if state is None:
-            # Shouldn't happen with our filtering, but be defensive
-            return {
-                'icao24': getattr(flight_connection, "icao24", None),
-                'lat': None,
-                'lng': None,
-                'from': from_airport,
-                'to': to_airport,
-                'last_contact': None
-            }
-
-        return {
-            'icao24': getattr(state, 'icao24', None),
-            'lat': getattr(state, 'latitude', None),
-            'lng': getattr(state, 'longitude', None),
-            'from': from_airport,
-            'to': to_airport,
-            'last_contact': getattr(state, 'last_contact', None)
-        }
\ No newline at end of file
+        # Keep only connections with a currently tracked state. The intersection of the key views is computed in C
+        # and iterates over the smaller of the two (the flight connections)
+        tracked_icao24s = flight_connections_dict.keys() & states_dict.keys()
+
+        get_flight_data = _get_flight_data
+
+        return [get_flight_data(states_dict[icao24], flight_connections_dict[icao24]) for icao24 in tracked_icao24s]
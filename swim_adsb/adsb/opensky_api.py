@@ -24,6 +24,7 @@
 import calendar
 import logging
 import pprint
+import threading
 import time
 from collections import defaultdict
 from datetime import datetime
@@ -314,13 +315,16 @@ class OpenSkyApi(object):
         # Token cache
         self._access_token: Optional[str] = None
         self._token_expiry_epoch: float = 0.0  # epoch seconds
+        # Serializes the token requests of concurrent callers
+        self._token_lock = threading.Lock()
 
         # HTTP plumbing
         self._session = session or self._build_session()
         self._api_url = "https://opensky-network.org/api"
         self._last_requests = defaultdict(lambda: 0)
 
-    def _build_session(self, total_retries: int = 5, backoff_factor: float = 1.5) -> requests.Session:
+    @staticmethod
+    def _build_session(total_retries: int = 5, backoff_factor: float = 1.5) -> requests.Session:
         """
         Create a requests.Session configured to automatically retry on transient failures,
         including HTTP 429 (rate limit), honoring Retry-After when provided.
@@ -428,6 +432,16 @@ class OpenSkyApi(object):
         if not force and self._token_valid():
             return self._access_token
 
+        token_before_waiting = self._access_token
+        with self._token_lock:
+            # another caller may have obtained a new token while we were waiting
+            if self._token_valid() and (not force or self._access_token != token_before_waiting):
+                return self._access_token
+
+            return self._request_access_token()
+
+    def _request_access_token(self) -> Optional[str]:
+        """Request a new OAuth2 access token and cache it."""
         data = {
             "grant_type": "client_credentials",
             "client_id": self._client_id,
@@ -476,13 +490,15 @@ class OpenSkyApi(object):
     # -----------------------------
     # HTTP core
     # -----------------------------
-    def _get_json(self, url_post: str, callee: Callable, params: Optional[Dict[str, Any]] = None):
+    def _get_json(self, url_post: str, callee: Callable, params: Optional[Dict[str, Any]] = None,
+                  not_found_json: Any = None):
         """
         Sends HTTP request to the given endpoint and returns the response as a json.
 
         :param str url_post: endpoint to which the request will be sent.
         :param Callable callee: method that calls _get_json().
         :param dict params: request parameters.
+        :param not_found_json: the json to return if the endpoint answers 404, i.e. it found no data.
         :rtype: dict|None
         """
         headers = {}
@@ -512,6 +528,9 @@ class OpenSkyApi(object):
         if r.status_code == 200:
             self._last_requests[callee] = time.time()
             return r.json()
+        elif r.status_code == 404 and not_found_json is not None:
+            self._last_requests[callee] = time.time()
+            return not_found_json
         else:
             logger.debug(
                 "Response not OK. Status %d - %s - Body: %s",
@@ -681,7 +700,8 @@ class OpenSkyApi(object):
         :param str airport: ICAO identier for the airport.
         :param int begin: Start of time interval to retrieve flights for as Unix time (seconds since epoch).
         :param int end: End of time interval to retrieve flights for as Unix time (seconds since epoch).
-        :return: list of FlightData objects if request was successful, None otherwise..
+        :return: list of FlightData objects if request was successful (empty if the airport had no flights),
+            None otherwise.
         :rtype: FlightData | None
         """
         if begin >= end:
@@ -691,7 +711,7 @@ class OpenSkyApi(object):
 
         params = {"airport": airport, "begin": begin, "end": end}
         states_json = self._get_json(
-            "/flights/arrival", self.get_arrivals_by_airport, params=params
+            "/flights/arrival", self.get_arrivals_by_airport, params=params, not_found_json=[]
         )
 
         if states_json is not None:
@@ -705,7 +725,8 @@ class OpenSkyApi(object):
         :param str airport: ICAO identier for the airport.
         :param int begin: Start of time interval to retrieve flights for as Unix time (seconds since epoch).
         :param int end: End of time interval to retrieve flights for as Unix time (seconds since epoch).
-        :return: list of FlightData objects if request was successful, None otherwise.
+        :return: list of FlightData objects if request was successful (empty if the airport had no flights),
+            None otherwise.
         :rtype: FlightData | None
         """
         if begin >= end:
@@ -715,12 +736,12 @@ class OpenSkyApi(object):
 
         params = {"airport": airport, "begin": begin, "end": end}
         states_json = self._get_json(
-            "/flights/departure", self.get_departures_by_airport, params=params
+            "/flights/departure", self.get_departures_by_airport, params=params, not_found_json=[]
         )
 
         if states_json is not None:
             return [FlightData(list(entry.values())) for entry in states_json]
-        return []
+        return None
 
     def get_track_by_aircraft(self, icao24: str, t: int = 0):
         """
@@ -79,6 +79,9 @@ air_traffic = AirTraffic(
 )
 interval_in_sec = config['ADSB']['INTERVAL_IN_SEC']
 
+# warm up the flight connections cache so that the first messages do not wait for OpenSky
+air_traffic.prefetch_airports(list(config['ADSB']['CITIES'].values()))
+
 for city, code in config['ADSB']['CITIES'].items():
     swim_publisher.add_topic_messenger(Messenger(
         id=f"arrivals.{city.lower()}",
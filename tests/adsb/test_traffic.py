@@ -27,7 +27,22 @@ http://opensource.org/licenses/BSD-3-Clause
 
 Details on EUROCONTROL: http://www.eurocontrol.int
 """
-from swim_adsb.adsb.air_traffic import AirTraffic
+import copy
+import json
+import logging
+import threading
+import time
+from datetime import date, datetime
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+import requests
+
+from swim_adsb.adsb import air_traffic as air_traffic_module
+from swim_adsb.adsb.air_traffic import AirTraffic, _day_span, _EnvCredentials, _OpenSkyUnavailableError, \
+    _ttl_from_env
+from swim_adsb.adsb.opensky_api import FlightData, StateVector, OpenSkyApi
 
 __author__ = "EUROCONTROL (SWIM)"
 
@@ -43,14 +58,21 @@ airports = {
 air_traffic = AirTraffic(5)
 
 
+@pytest.fixture
+def traffic():
+    """
+    An AirTraffic instance with a mocked OpenSky client.
+    """
+    with mock.patch.object(air_traffic_module, 'OpenSkyApi'):
+        return AirTraffic(1)
+
+
 def test_traffic():
 
-    states = air_traffic._get_states()
-    states_dict = {state.icao24: state for state in states if state.icao24}
+    states_dict = air_traffic.get_states_dict()
 
     for city, code in airports.items():
-        arrivals = air_traffic._arrivals_today_handler(code)
-        arrivals_dict = {arr.icao24: arr for arr in arrivals if arr.icao24}
+        arrivals_dict = air_traffic._arrivals_today_handler(code)
 
         print(f"Arrivals in {city}")
         for arr_icao24, arr in arrivals_dict.items():
@@ -62,8 +84,7 @@ def test_traffic():
             print(f"{state.icao24} flying from {arr.est_departure_airport}: "
                   f"{state.latitude}, {state.longitude}")
 
-        departures = air_traffic._departures_today_handler(code)
-        departures_dict = {arr.icao24: arr for arr in departures if arr.icao24}
+        departures_dict = air_traffic._departures_today_handler(code)
 
         print(f"Departures from {city}")
         for dep_icao24, dep in departures_dict.items():
@@ -74,3 +95,338 @@ def test_traffic():
 
             print(f"{state.icao24} flying to {dep.est_arrival_airport}: "
                   f"{state.latitude}, {state.longitude}")
+
+
+def test_arrivals_and_departures_do_not_share_cache_entries(traffic):
+    traffic.client.get_arrivals_by_airport.return_value = [FlightData(['aaaaaa', 0, 'EHAM', 0, 'EBBR'])]
+    traffic.client.get_departures_by_airport.return_value = [FlightData(['bbbbbb', 0, 'EBBR', 0, 'LFPG'])]
+
+    arrivals = traffic._arrivals_today_handler('EBBR')
+    departures = traffic._departures_today_handler('EBBR')
+
+    assert list(arrivals) == ['aaaaaa']
+    assert list(departures) == ['bbbbbb']
+
+
+def test_concurrent_identical_requests_hit_opensky_once(traffic):
+
+    def slow_arrivals(*args):
+        time.sleep(0.1)
+        return [FlightData(['cccccc', 0, 'EHAM', 0, 'EDDB'])]
+
+    traffic.client.get_arrivals_by_airport.side_effect = slow_arrivals
+
+    threads = [threading.Thread(target=traffic._arrivals_today_handler, args=('EDDB',)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert traffic.client.get_arrivals_by_airport.call_count == 1
+
+
+def test_day_span__covers_whole_days():
+    begin, end = _day_span(date(2019, 6, 18).toordinal(), 3)
+
+    assert begin == int(datetime(2019, 6, 15, 0, 0, 0).timestamp())
+    assert end == int(datetime(2019, 6, 18, 23, 59, 59).timestamp())
+
+
+def test_flight_connection_handler__keeps_only_tracked_flights():
+    states_dict = {
+        'aaaaaa': StateVector(['aaaaaa', 'ABC123', 'Belgium', 0, 1560869065, 4.48, 50.9]),
+        'dddddd': StateVector(['dddddd', 'DEF456', 'Greece', 0, 1560869066, 23.9, 37.9]),
+    }
+    flight_connections = {
+        'aaaaaa': FlightData(['aaaaaa', 0, None, 0, 'EBBR']),
+        'bbbbbb': FlightData(['bbbbbb', 0, 'EHAM', 0, 'EBBR']),
+    }
+
+    data = air_traffic._flight_connection_handler(states_dict, flight_connections)
+
+    assert data == [{
+        'icao24': 'aaaaaa',
+        'lat': 50.9,
+        'lng': 4.48,
+        'from': 'Unknown airport',
+        'to': 'EBBR',
+        'last_contact': 1560869065
+    }]
+
+
+def test_arrivals_handler__returns_json_message(traffic):
+    traffic.client.get_arrivals_by_airport.return_value = [FlightData(['eeeeee', 0, 'EBBR', 0, 'LGAV'])]
+    traffic.client.get_states.return_value.states = [
+        StateVector(['eeeeee', 'GHI789', 'Belgium', 0, 1560869065, 12.25, 41.87])
+    ]
+
+    message = traffic.arrivals_handler('LGAV')
+
+    assert message.content_type == 'application/json'
+    assert json.loads(message.body) == [{
+        'icao24': 'eeeeee',
+        'lat': 41.87,
+        'lng': 12.25,
+        'from': 'EBBR',
+        'to': 'LGAV',
+        'last_contact': 1560869065
+    }]
+
+
+def test_handlers_sharing_a_context_reuse_the_states_snapshot(traffic):
+    traffic.client.get_arrivals_by_airport.return_value = []
+    traffic.client.get_departures_by_airport.return_value = []
+    traffic.client.get_states.return_value.states = []
+    context = SimpleNamespace()
+
+    traffic.arrivals_handler('EHAM', context=context)
+    states_dict = context.states_snapshot.states_dict
+
+    with mock.patch.object(traffic, '_build_states_dict') as build_states_dict:
+        traffic.departures_handler('EHAM', context=context)
+
+    build_states_dict.assert_not_called()
+    assert context.states_snapshot.states_dict is states_dict
+
+
+def test_handler_payload_is_reused_until_its_sources_change(traffic):
+    traffic.client.get_departures_by_airport.return_value = [FlightData(['ffffff', 0, 'EDDB', 0, 'LFPG'])]
+    states_dict = {'ffffff': StateVector(['ffffff', 'JKL012', 'Germany', 0, 1560869065, 13.5, 52.4])}
+
+    with mock.patch.object(traffic, 'get_states_dict', return_value=states_dict), \
+            mock.patch.object(traffic, '_flight_connection_handler', wraps=traffic._flight_connection_handler) as handler:
+        first = traffic.departures_handler('EDDB').body
+        second = traffic.departures_handler('EDDB').body
+
+        assert handler.call_count == 1
+        assert first == second
+
+        states_dict = {}
+        traffic.get_states_dict.return_value = states_dict
+
+        assert json.loads(traffic.departures_handler('EDDB').body) == []
+        assert handler.call_count == 2
+
+
+def test_credentials_are_filled_from_the_environment():
+    env_credentials = _EnvCredentials(
+        client_id='client_id',
+        client_secret='client_secret',
+        token_url=None,
+        scope=None,
+        username=None,
+        password=None
+    )
+
+    with mock.patch.object(air_traffic_module, '_ENV_CREDENTIALS', env_credentials):
+        traffic = AirTraffic(1)
+
+    assert traffic.client._client_id == 'client_id'
+    assert traffic.client._client_secret == 'client_secret'
+
+
+def test_expired_states_are_served_while_being_refreshed(traffic):
+    traffic.client.get_states.return_value.states = [StateVector(['aaaaaa'])]
+
+    states_dict = traffic.get_states_dict()
+
+    traffic.client.get_states.return_value.states = [StateVector(['bbbbbb'])]
+    one_window_later = time.monotonic() + air_traffic_module._STATES_TTL + 1
+
+    with mock.patch.object(air_traffic_module, 'monotonic', return_value=one_window_later), \
+            mock.patch.object(air_traffic_module, '_STATES_REFRESH_EXECUTOR') as executor:
+        assert traffic.get_states_dict() is states_dict
+        assert traffic.get_states_dict() is states_dict
+
+    executor.submit.assert_called_once()
+
+    refresh, *args = executor.submit.call_args[0]
+    refresh(*args)
+
+    assert list(traffic.get_states_dict()) == ['bbbbbb']
+
+
+def test_states_are_refreshed_while_flight_connections_refreshes_are_pending(traffic):
+    traffic.client.get_arrivals_by_airport.return_value = []
+    airports = ['EDDB', 'EHAM', 'LGAV']
+
+    for airport in airports:
+        traffic._arrivals_today_handler(airport)
+
+    release = threading.Event()
+    traffic.client.get_arrivals_by_airport.side_effect = lambda *args: release.wait(10) and []
+    traffic.client.get_states.return_value.states = [StateVector(['aaaaaa'])]
+    clock = [time.monotonic() + air_traffic_module._FLIGHTS_TTL + 1]
+
+    try:
+        with mock.patch.object(air_traffic_module, 'monotonic', side_effect=lambda: clock[0]):
+            states_dict = traffic.get_states_dict()
+
+            # more refreshes than the flights pool has workers
+            for airport in airports:
+                traffic._arrivals_today_handler(airport)
+
+            traffic.client.get_states.return_value.states = [StateVector(['bbbbbb'])]
+            clock[0] += air_traffic_module._STATES_TTL + 1
+
+            assert traffic.get_states_dict() is states_dict
+
+            deadline = time.monotonic() + 2
+            while list(traffic.get_states_dict()) != ['bbbbbb'] and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            assert list(traffic.get_states_dict()) == ['bbbbbb']
+    finally:
+        release.set()
+
+def test_expired_flight_connections_are_kept_when_the_refresh_fails(traffic):
+    traffic.client.get_arrivals_by_airport.return_value = [FlightData(['aaaaaa', 0, 'EHAM', 0, 'LGAV'])]
+
+    arrivals = traffic._arrivals_today_handler('LGAV')
+
+    traffic.client.get_arrivals_by_airport.side_effect = requests.exceptions.ConnectionError('connection reset')
+    expired = time.monotonic() + air_traffic_module._FLIGHTS_TTL + 1
+
+    with mock.patch.object(air_traffic_module, 'monotonic', return_value=expired), \
+            mock.patch.object(air_traffic_module, '_FLIGHTS_REFRESH_EXECUTOR') as executor:
+        assert traffic._arrivals_today_handler('LGAV') is arrivals
+
+        refresh = executor.submit.call_args[0][0]
+        assert refresh() is arrivals
+
+        # the refresh is retried after a delay, meanwhile the stale value is served
+        assert traffic._arrivals_today_handler('LGAV') is arrivals
+        executor.submit.assert_called_once()
+
+
+def test_failed_flight_connections_are_not_cached_for_the_whole_ttl(traffic):
+    traffic.client.get_departures_by_airport.return_value = None
+
+    assert traffic._departures_today_handler('EHAM') == {}
+
+    traffic.client.get_departures_by_airport.return_value = [FlightData(['bbbbbb', 0, 'EHAM', 0, 'LFPG'])]
+    retry_delay = air_traffic_module._FAILED_REFRESH_RETRY_DELAY
+    after_retry_delay = time.monotonic() + retry_delay + 1
+
+    with mock.patch.object(air_traffic_module, 'monotonic', return_value=after_retry_delay), \
+            mock.patch.object(air_traffic_module, '_FLIGHTS_REFRESH_EXECUTOR') as executor:
+        traffic._departures_today_handler('EHAM')
+        executor.submit.call_args[0][0]()
+
+    assert list(traffic._departures_today_handler('EHAM')) == ['bbbbbb']
+
+
+def test_airports_without_flights_are_cached_for_the_whole_ttl(traffic):
+    session = mock.Mock()
+    session.get.return_value = mock.Mock(status_code=404, reason='Not Found', text='')
+    traffic.client = OpenSkyApi(session=session)
+
+    assert traffic._departures_today_handler('LGKO') == {}
+
+    within_ttl = time.monotonic() + air_traffic_module._FAILED_REFRESH_RETRY_DELAY + 1
+
+    with mock.patch.object(air_traffic_module, 'monotonic', return_value=within_ttl):
+        assert traffic._departures_today_handler('LGKO') == {}
+
+    session.get.assert_called_once()
+
+def test_outdated_entries_are_evicted(traffic):
+    traffic.client.get_arrivals_by_airport.return_value = []
+    traffic._arrivals_today_handler('EDDB')
+
+    other_traffic = copy.copy(traffic)
+    outdated = time.monotonic() + 2 * air_traffic_module._FLIGHTS_TTL + 1
+
+    with mock.patch.object(air_traffic_module, 'monotonic', return_value=outdated):
+        other_traffic._arrivals_today_handler('EDDB')
+
+    assert not any(traffic in key for key in air_traffic_module._FLIGHTS_CACHE)
+
+
+def test_transient_api_errors_are_logged_once_as_warnings(traffic, caplog):
+    traffic.client.get_arrivals_by_airport.side_effect = requests.exceptions.ConnectionError('connection reset')
+    traffic.client.get_departures_by_airport.side_effect = ValueError('unexpected payload')
+
+    with caplog.at_level(logging.WARNING, logger=air_traffic_module.__name__), \
+            mock.patch.dict(air_traffic_module._API_ERRORS_LOGGED_AT, clear=True):
+        for icao, callback in [('LGAV', traffic.client.get_arrivals_by_airport),
+                               ('LGAV', traffic.client.get_arrivals_by_airport),
+                               ('LFPG', traffic.client.get_departures_by_airport)]:
+            with pytest.raises(_OpenSkyUnavailableError):
+                traffic._flight_connections_today(icao, callback=callback)
+
+    assert [record.levelno for record in caplog.records] == [logging.WARNING, logging.ERROR]
+
+
+def test_empty_api_responses_are_logged_as_warnings(traffic, caplog):
+    traffic.client.get_arrivals_by_airport.return_value = None
+    traffic.client.get_states.return_value = None
+
+    with caplog.at_level(logging.WARNING, logger=air_traffic_module.__name__), \
+            mock.patch.dict(air_traffic_module._API_ERRORS_LOGGED_AT, clear=True):
+        with pytest.raises(_OpenSkyUnavailableError):
+            traffic._flight_connections_today('LGAV', callback=traffic.client.get_arrivals_by_airport)
+        with pytest.raises(_OpenSkyUnavailableError):
+            traffic._get_states()
+
+    assert [record.levelno for record in caplog.records] == [logging.WARNING, logging.WARNING]
+
+def test_prefetch_airports__warms_up_the_flight_connections_cache(traffic):
+    traffic.client.get_arrivals_by_airport.return_value = [FlightData(['aaaaaa', 0, 'EHAM', 0, 'EBBR'])]
+    traffic.client.get_departures_by_airport.return_value = [FlightData(['bbbbbb', 0, 'EBBR', 0, 'LFPG'])]
+
+    traffic.prefetch_airports(['EBBR', 'LFPG'])
+
+    assert traffic.client.get_arrivals_by_airport.call_count == 2
+    assert traffic.client.get_departures_by_airport.call_count == 2
+
+    traffic._arrivals_today_handler('EBBR')
+    traffic._departures_today_handler('LFPG')
+
+    assert traffic.client.get_arrivals_by_airport.call_count == 2
+    assert traffic.client.get_departures_by_airport.call_count == 2
+
+
+@pytest.mark.parametrize('value, expected_ttl', [
+    (None, 1800),
+    ('600', 600),
+    ('ten minutes', 1800),
+    ('-1', 1800),
+])
+def test_ttl_from_env(value, expected_ttl):
+    environ = {} if value is None else {'OPENSKY_FLIGHTS_TTL': value}
+
+    with mock.patch.dict('os.environ', environ, clear=True):
+        assert _ttl_from_env('OPENSKY_FLIGHTS_TTL', default=1800) == expected_ttl
+
+
+def test_stale_states_are_not_reused_from_the_context(traffic):
+    traffic.client.get_states.return_value.states = [StateVector(['aaaaaa'])]
+    traffic.get_states_dict()
+
+    context = SimpleNamespace()
+    expired = time.monotonic() + air_traffic_module._STATES_TTL + 1
+
+    with mock.patch.object(air_traffic_module, 'monotonic', return_value=expired), \
+            mock.patch.object(air_traffic_module, '_STATES_REFRESH_EXECUTOR'):
+        traffic.get_states_dict(context)
+
+        assert context.states_snapshot.expires_at < expired
+
+
+def test_prefetch_airports__requests_a_single_oauth_token(traffic):
+    session = mock.Mock()
+
+    def post_token(*args, **kwargs):
+        time.sleep(0.1)
+        return mock.Mock(status_code=200, json=mock.Mock(return_value={'access_token': 'token', 'expires_in': 1800}))
+
+    session.post.side_effect = post_token
+    session.get.return_value = mock.Mock(status_code=200, json=mock.Mock(return_value=[]))
+
+    traffic.client = OpenSkyApi(client_id='client_id', client_secret='client_secret', session=session)
+
+    traffic.prefetch_airports(['EBBR', 'EHAM', 'LFPG', 'EDDB'])
+
+    assert session.post.call_count == 1
+    assert session.get.call_count == 8